@@ -3,21 +3,51 @@
 import streamlit as st
 import os
 import json
+import time
 import logging
-from io import BytesIO
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+import pandas as pd
 
 # Local imports
 import llm_agents
 from llm_agents import generate_test_cases_with_logging
-from grader_langgraph import run_grader_pipeline
+from grader_langgraph import build_report_pdf, run_grader_pipeline
 
-# Logging setup
-logging.basicConfig(level=logging.INFO)
+# Logging setup (library modules only create loggers; the app owns handlers)
+def setup_logging() -> None:
+    if not logging.getLogger().hasHandlers():
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Streamlit reruns the whole script on every interaction; identical code is
+# answered from this in-process cache instead of another Groq round trip.
+# Status messages stay outside so they still render on a cache hit.
+class _Uncached(Exception):
+    """Carries a non-"ok" result out of the cached function; st.cache_data never stores exceptions."""
+    def __init__(self, result: dict):
+        super().__init__(result.get("reason"))
+        self.result = result
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_test_cases(code_text: str, refresh_nonce: float) -> dict:
+    # A non-zero nonce makes a fresh cache entry and skips the LLM response cache.
+    res = generate_test_cases_with_logging(code_text, refresh=bool(refresh_nonce)).to_dict()
+    if res["status"] != "ok":
+        # Fallbacks (rate limit, open breaker, missing key) must not be pinned for every session.
+        raise _Uncached(res)
+    return res
+
+def cached_test_cases(code_text: str, refresh_nonce: float = 0.0) -> dict:
+    try:
+        return _cached_test_cases(code_text, refresh_nonce)
+    except _Uncached as e:
+        return e.result
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_report_pdf(report_text: str, final_score: float) -> bytes:
+    return build_report_pdf(report_text, final_score)
+
 # ---------------------------------------------------------------------
 # PAGE CONFIGURATION
 # ---------------------------------------------------------------------
@@ -89,6 +119,18 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# ---------------------------------------------------------------------
+# SIDEBAR
+# ---------------------------------------------------------------------
+force_refresh = st.sidebar.toggle(
+    "Force refresh", help="Ignore cached LLM answers and ask the models again."
+)
+if st.sidebar.button("Clear cache"):
+    st.cache_data.clear()
+    st.sidebar.success("Cached test cases and PDFs cleared.")
+# Filled in at the end of the script, so the counts include this run's LLM calls.
+retry_stats_box = st.sidebar.empty()
+
 # ---------------------------------------------------------------------
 # HEADER
 # ---------------------------------------------------------------------
@@ -125,8 +167,14 @@ if not code_text:
 else:
     if st.button("Generate Test Cases"):
         with st.spinner("Analyzing code and generating test cases via Groq OSS 20B..."):
-            res = generate_test_cases_with_logging(code_text)
-        if res["status"] in ["ok", "fallback"]:
+            res = cached_test_cases(code_text, time.time() if force_refresh else 0.0)
+        prompt_chars = len(llm_agents.minify_c(code_text))
+        if prompt_chars > llm_agents.MAX_CODE_CHARS:
+            st.warning(
+                f"Your code is {prompt_chars} characters without comments; only the first and last "
+                f"{llm_agents.MAX_CODE_CHARS // 2} were sent to the model for test generation."
+            )
+        if res["status"] in ["ok", "fallback", "heuristic-fast"]:
             st.session_state["tests"] = "\n".join(res["tests"])
             st.success(f"{len(res['tests'])} test cases generated successfully.")
             st.text_area("Generated Test Cases (editable):", st.session_state["tests"], height=200)
@@ -149,11 +197,8 @@ if st.button("Run Evaluation"):
         left, right = st.columns([0.55, 0.45])
         with left:
             with st.spinner("Running compilation, static analysis, and test suite..."):
-                evaluation = run_grader_pipeline(
-                    code_text,
-                    tests_raw.splitlines(),
-                    llm_reporter=llm_agents.generate_llm_report,
-                )
+                # The report is streamed in the right column instead of being generated here.
+                evaluation = run_grader_pipeline(code_text, tests_raw.splitlines())
 
             compile_info = evaluation.get("compile", {})
             static_info = evaluation.get("static", {})
@@ -183,12 +228,17 @@ if st.button("Run Evaluation"):
                 total = len(test_info)
                 passed = sum(1 for t in test_info if t["success"])
                 st.metric(label="Tests Passed", value=f"{passed}/{total}")
-                for i, t in enumerate(test_info, 1):
-                    with st.expander(f"Test {i}: {'Passed ✅' if t['success'] else 'Failed ❌'}"):
-                        st.write(f"**Input:** `{t['input']}`")
-                        st.write(f"**Expected:** `{t['expected']}`")
-                        st.write(f"**Actual:** `{t['actual']}`")
-                        st.write(f"**Comment:** {t['comment']}")
+                # One table built column by column; newlines are shown escaped so each test stays one row.
+                df = pd.DataFrame({
+                    "Result": ["✅" if t["success"] else "❌" for t in test_info],
+                    "Input": [t["input"] for t in test_info],
+                    "Expected": [t["expected"] for t in test_info],
+                    "Actual": [t["actual"] for t in test_info],
+                    "Comment": [t["comment"] for t in test_info],
+                }, index=pd.RangeIndex(1, total + 1, name="Test"))
+                for col in ("Input", "Expected", "Actual"):
+                    df[col] = df[col].str.replace("\n", "\\n", regex=False)
+                st.dataframe(df, use_container_width=True)
 
             st.markdown("#### Performance")
             st.info(perf_info.get("comment", "Performance not available."))
@@ -198,35 +248,15 @@ if st.button("Run Evaluation"):
 
         with right:
             st.markdown("#### Gemini 2.5 Flash Feedback Report")
-            with st.spinner("Generating detailed AI feedback..."):
-                try:
-                    report_text = llm_agents.generate_llm_report(evaluation)
-                except Exception as e:
-                    report_text = f"Error generating report: {e}"
-
-            safe_html = report_text.replace("\n", "<br/>")
-            st.markdown(f"<div class='report-box'>{safe_html}</div>", unsafe_allow_html=True)
+            # Streamed so feedback appears as Gemini writes it, not after the whole completion.
+            report_input = {k: evaluation.get(k) for k in ("compile", "static", "test", "perf", "final_score")}
+            with st.container(border=True):
+                report_text = st.write_stream(
+                    llm_agents.generate_llm_report_stream(report_input, refresh=force_refresh)
+                )
 
             # -------- PDF GENERATION --------
-            def generate_pdf(report: str) -> BytesIO:
-                buffer = BytesIO()
-                doc = SimpleDocTemplate(buffer, pagesize=A4)
-                styles = getSampleStyleSheet()
-                story = [
-                    Paragraph("<b>C Autograder Evaluation Report</b>", styles["Title"]),
-                    Spacer(1, 12),
-                    Paragraph(f"<b>Final Score:</b> {final_score}/100", styles["Normal"]),
-                    Spacer(1, 12),
-                    Paragraph("<b>Detailed Feedback</b>", styles["Heading2"]),
-                    Paragraph(report.replace("\n", "<br/>"), styles["Normal"]),
-                    Spacer(1, 20),
-                    Paragraph("<b>Generated via Gemini 2.5 Flash</b>", styles["Italic"])
-                ]
-                doc.build(story)
-                buffer.seek(0)
-                return buffer
-
-            pdf_bytes = generate_pdf(report_text)
+            pdf_bytes = cached_report_pdf(report_text, final_score)
             st.download_button(
                 "Download Report (PDF)",
                 data=pdf_bytes,
@@ -235,6 +265,11 @@ if st.button("Run Evaluation"):
                 use_container_width=True,
             )
 
+retry_stats_box.caption("  \n".join(
+    f"{provider}: {counts['calls']} calls, {counts['retries']} retries"
+    for provider, counts in llm_agents.retry_stats().items()
+))
+
 # ---------------------------------------------------------------------
 # FOOTER
 # ---------------------------------------------------------------------
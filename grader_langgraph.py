@@ -1,19 +1,29 @@
 # grader_langgraph.py
 import os
+import asyncio
 import tempfile
 import subprocess
 import time
 import json
 import shutil
 import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Preformatted, Spacer
+
+try:
+    import orjson  # optional: faster serialization of the evaluation dict
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
+
+# Built once per process; getSampleStyleSheet() is costly to rebuild per PDF.
+_STYLES = getSampleStyleSheet()
 
 # ---------------- Diagnostics ----------------
 def run_diagnostics() -> Dict[str, Any]:
@@ -30,6 +40,12 @@ def run_diagnostics() -> Dict[str, Any]:
     diag["genai_env"] = diag["details"]["env_GENAI_API_KEY"]
     return diag
 
+# ----------------- JSON helpers -----------------
+def _dumps_indented(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS, default=str).decode()
+    return json.dumps(obj, indent=2, default=str)
+
 # ----------------- Test normalization -----------------
 def _try_parse_json(text: str):
     try:
@@ -123,70 +139,93 @@ def run_cppcheck(src_path: str) -> Dict[str, Any]:
     except Exception as e:
         return {"available": True, "issues": [f"cppcheck error: {e}"]}
 
+# ----------------- Sandboxing -----------------
+_MEM_LIMIT_BYTES = 256 * 1024 * 1024
+
+# POSIX only: limits are set by the shell, which then execs the submission.
+_SANDBOX_SH = shutil.which("sh") if os.name == "posix" else None
+
+def _sandboxed(cmd: List[str], cpu_seconds: int) -> List[str]:
+    """
+    Wrap a submission command so it runs with capped CPU time and address space.
+    The limits are applied by `ulimit` before exec rather than by a preexec_fn:
+    tests run on several threads, and Python code in a forked child can deadlock then.
+    """
+    if _SANDBOX_SH is None:
+        return cmd
+    script = f'ulimit -t {cpu_seconds}; ulimit -v {_MEM_LIMIT_BYTES // 1024}; exec "$0" "$@"'
+    return [_SANDBOX_SH, "-c", script, *cmd]
+
 # ----------------- Run tests (safe, prompt-tolerant) -----------------
+def _run_one_test(binary_path: str, t: Dict[str,str], timeout_per_test: int) -> Dict[str, Any]:
+    inp = t.get("input", "")
+    expected = t.get("expected", "").strip()
+    try:
+        start = time.time()
+        proc = subprocess.run(_sandboxed([binary_path], timeout_per_test + 1), input=inp.encode(),
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout_per_test)
+        elapsed = time.time() - start
+        out = proc.stdout.decode(errors="ignore").strip()
+        stderr = proc.stderr.decode(errors="ignore").strip()
+
+        # --- Prompt-tolerant normalization ---
+        normalized_out = out.strip()
+        normalized_expected = expected.strip()
+
+        if normalized_out == normalized_expected or normalized_out.endswith(normalized_expected):
+            success = True
+        elif normalized_out.replace("\n", " ").endswith(normalized_expected.replace("\n", " ")):
+            success = True
+        else:
+            success = False
+
+        comment = "OK" if success else (
+            "mismatch" if expected != "" else ("non-zero exit" if proc.returncode != 0 else "OK")
+        )
+        return {
+            "input": inp,
+            "expected": expected,
+            "actual": out,
+            "stderr": stderr,
+            "success": success,
+            "time": round(elapsed, 4),
+            "comment": comment,
+        }
+    except subprocess.TimeoutExpired:
+        return {
+            "input": inp,
+            "expected": expected,
+            "actual": "(timeout)",
+            "stderr": "",
+            "success": False,
+            "time": None,
+            "comment": f"timed out after {timeout_per_test}s",
+        }
+    except Exception as e:
+        return {
+            "input": inp,
+            "expected": expected,
+            "actual": "",
+            "stderr": str(e),
+            "success": False,
+            "time": None,
+            "comment": "runtime error",
+        }
+
 def run_tests_on_binary(binary_path: str, tests: List[Dict[str,str]], timeout_per_test: int = 5) -> Dict[str, Any]:
-    results = []
-    passed = 0
+    """
+    Run every test against the compiled binary. Each case is its own process that
+    mostly waits on I/O, so cases run concurrently on a thread pool (one per core)
+    rather than back to back; result order matches `tests`.
+    """
     total = len(tests)
     if not binary_path:
         return {"status": "error", "results": [], "passed": 0, "total": total, "score": 0}
 
-    for t in tests:
-        inp = t.get("input", "")
-        expected = t.get("expected", "").strip()
-        try:
-            start = time.time()
-            proc = subprocess.run([binary_path], input=inp.encode(), stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE, timeout=timeout_per_test)
-            elapsed = time.time() - start
-            out = proc.stdout.decode(errors="ignore").strip()
-            stderr = proc.stderr.decode(errors="ignore").strip()
-
-            # --- Prompt-tolerant normalization ---
-            normalized_out = out.strip()
-            normalized_expected = expected.strip()
-
-            if normalized_out == normalized_expected or normalized_out.endswith(normalized_expected):
-                success = True
-            elif normalized_out.replace("\n", " ").endswith(normalized_expected.replace("\n", " ")):
-                success = True
-            else:
-                success = False
-
-            comment = "OK" if success else (
-                "mismatch" if expected != "" else ("non-zero exit" if proc.returncode != 0 else "OK")
-            )
-            results.append({
-                "input": inp,
-                "expected": expected,
-                "actual": out,
-                "stderr": stderr,
-                "success": success,
-                "time": round(elapsed, 4),
-                "comment": comment,
-            })
-            if success:
-                passed += 1
-        except subprocess.TimeoutExpired:
-            results.append({
-                "input": inp,
-                "expected": expected,
-                "actual": "(timeout)",
-                "stderr": "",
-                "success": False,
-                "time": None,
-                "comment": f"timed out after {timeout_per_test}s",
-            })
-        except Exception as e:
-            results.append({
-                "input": inp,
-                "expected": expected,
-                "actual": "",
-                "stderr": str(e),
-                "success": False,
-                "time": None,
-                "comment": "runtime error",
-            })
+    workers = max(1, min(os.cpu_count() or 1, total))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        results = list(ex.map(lambda t: _run_one_test(binary_path, t, timeout_per_test), tests))
+    passed = sum(1 for r in results if r["success"])
 
     score = round((passed / total * 100), 2) if total > 0 else 0.0
     return {"status": "done", "results": results, "passed": passed, "total": total, "score": score}
@@ -199,7 +238,9 @@ def measure_perf(binary_path: str) -> Dict[str,Any]:
     for _ in range(3):
         try:
             start = time.time()
-            subprocess.run([binary_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=3)
+            # Same limits as test runs; stdin is closed so a scanf can't wait on the server's terminal.
+            subprocess.run(_sandboxed([binary_path], 4), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE, timeout=3)
             times.append(time.time() - start)
         except Exception:
             return {"avg_time": None, "comment": "perf run failed or timed out"}
@@ -207,30 +248,91 @@ def measure_perf(binary_path: str) -> Dict[str,Any]:
     return {"avg_time": avg, "comment": ("fast" if avg < 0.1 else "moderate" if avg < 0.5 else "slow")}
 
 # ----------------- PDF builder -----------------
+def _title_band(title: str):
+    """
+    onFirstPage callback drawing a fixed title in the top margin with plain canvas
+    ops, so the constant header is not re-laid out by Platypus for every report.
+    """
+    def draw(canvas, doc):
+        canvas.saveState()
+        canvas.setFont("Helvetica-Bold", 18)
+        canvas.drawCentredString(doc.pagesize[0] / 2, doc.pagesize[1] - 48, title)
+        canvas.restoreState()
+    return draw
+
+_DEBUG_TITLE = _title_band("C Autograder Report")
+_REPORT_TITLE = _title_band("C Autograder Evaluation Report")
+
+def _markup(text: str) -> str:
+    """Paragraph markup for plain text: '<' and '&' (common in C and compiler output) are escaped, newlines become <br/>."""
+    return escape(text).replace("\n", "<br/>")
+
 def build_pdf(report_text: str, evaluation: Dict[str,Any]) -> bytes:
     buf = BytesIO()
-    doc = SimpleDocTemplate(buf, pagesize=A4)
-    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(buf, pagesize=A4, pageCompression=1)
     elems = [
-        Paragraph("C Autograder Report", styles["Title"]),
-        Spacer(1, 8),
-        Paragraph(report_text.replace("\n", "<br/>"), styles["Normal"]),
+        Paragraph(_markup(report_text), _STYLES["Normal"]),
         Spacer(1, 8),
-        Paragraph("Evaluation JSON", styles["Heading3"]),
-        Paragraph(json.dumps(evaluation, indent=2).replace(" ", "&nbsp;"), styles["Code"]),
+        Paragraph("Evaluation JSON", _STYLES["Heading3"]),
+        # Preformatted lays the JSON out line by line without markup parsing; long lines are hard-wrapped.
+        Preformatted(_dumps_indented(evaluation), _STYLES["Code"], maxLineLength=95),
     ]
-    doc.build(elems)
+    doc.build(elems, onFirstPage=_DEBUG_TITLE)
     return buf.getvalue()
 
+def build_report_pdf(report_text: str, final_score: float) -> bytes:
+    """
+    Student-facing PDF: final score plus the LLM feedback. The feedback is split
+    on blank lines into one Paragraph per block so layout can break between them.
+    """
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, pageCompression=1)
+    story = [
+        Paragraph(f"<b>Final Score:</b> {final_score}/100", _STYLES["Normal"]),
+        Spacer(1, 12),
+        Paragraph("<b>Detailed Feedback</b>", _STYLES["Heading2"]),
+    ]
+    for block in report_text.split("\n\n"):
+        if block.strip():
+            story.append(Paragraph(_markup(block.strip()), _STYLES["Normal"]))
+            story.append(Spacer(1, 6))
+    story += [
+        Spacer(1, 20),
+        Paragraph("<b>Generated via Gemini 2.5 Flash</b>", _STYLES["Italic"]),
+    ]
+    doc.build(story, onFirstPage=_REPORT_TITLE)
+    return buf.getvalue()
+
+def _render_report_pdf(item: Tuple[str, float]) -> bytes:
+    report_text, final_score = item
+    return build_report_pdf(report_text, final_score)
+
+def render_report_pdfs(items: List[Tuple[str, float]]) -> List[bytes]:
+    """
+    Render many (report_text, final_score) PDFs for batch grading. ReportLab layout
+    is CPU-bound and holds the GIL, so work is spread over processes, not threads.
+    Only strings go in and bytes come out, so nothing ReportLab-specific is pickled.
+    """
+    workers = min(os.cpu_count() or 1, len(items))
+    if workers <= 1:
+        # spawning a pool costs more than rendering a single report
+        return [_render_report_pdf(item) for item in items]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(_render_report_pdf, items))
+
 # ----------------- Main pipeline -----------------
 def run_grader_pipeline(code_text: str, tests_raw: Any, llm_reporter=None, per_test_timeout: int = 5) -> Dict[str,Any]:
     diag = run_diagnostics()
     compile_info = compile_code_to_binary(code_text)
     src_path = os.path.join(compile_info.get("temp_dir", ""), "submission.c")
 
-    static_info = run_cppcheck(src_path) if os.path.exists(src_path) else {"available": False, "issues": ["source missing"]}
-    tests = normalize_tests_block(tests_raw)
-    test_info = run_tests_on_binary(compile_info.get("binary"), tests, timeout_per_test=per_test_timeout)
+    # cppcheck only reads the source, so it overlaps the test runs. It must finish
+    # before measure_perf: on a single core it would inflate the timed runs.
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        static_future = ex.submit(run_cppcheck, src_path) if os.path.exists(src_path) else None
+        tests = normalize_tests_block(tests_raw)
+        test_info = run_tests_on_binary(compile_info.get("binary"), tests, timeout_per_test=per_test_timeout)
+        static_info = static_future.result() if static_future else {"available": False, "issues": ["source missing"]}
     perf_info = measure_perf(compile_info.get("binary"))
 
     compile_ok = 1 if compile_info.get("status") == "success" else 0
@@ -273,3 +375,11 @@ def run_grader_pipeline(code_text: str, tests_raw: Any, llm_reporter=None, per_t
         "report": report_text,
         "pdf_bytes": pdf_bytes,
     }
+
+async def run_grader_pipeline_async(code_text: str, tests_raw: Any, llm_reporter=None, per_test_timeout: int = 5) -> Dict[str,Any]:
+    """
+    Awaitable run_grader_pipeline for async front ends. gcc, cppcheck, the test
+    binary and the Gemini report all block, so the whole pipeline runs in a worker
+    thread and the event loop keeps serving other requests meanwhile.
+    """
+    return await asyncio.to_thread(run_grader_pipeline, code_text, tests_raw, llm_reporter, per_test_timeout)
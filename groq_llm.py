@@ -1,11 +1,74 @@
 # groq_llm.py
 import os
+import asyncio
+import atexit
+import time
+import functools
 import requests
 import logging
-import json
+from requests.adapters import HTTPAdapter
+
+from llm_utils import backoff_delay, clip_code, retry_after_seconds
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
+
+GROQ_COMPLETIONS_URL = "https://api.groq.com/openai/v1/completions"
+# Rate limits and server errors are retried; other 4xx responses fail fast.
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+_MAX_ATTEMPTS = 5
+# Fail fast on an unreachable host, but give the completion itself time to finish.
+_TIMEOUT = (10, 40)  # (connect, read) seconds
+
+# One pooled keep-alive session for all Groq calls, so TCP/TLS setup is paid
+# once per connection instead of once per submission.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=64))
+atexit.register(_SESSION.close)
+
+# Fixed request fields; only the prompt varies per call.
+_PAYLOAD_BASE = {
+    "model": "openai/gpt-oss-120b",
+    "temperature": 0.2,
+    "max_tokens": 400,
+}
+
+@functools.lru_cache(maxsize=4)
+def _headers(api_key: str) -> dict:
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+def _iter_tests(text: str, cap: int):
+    """
+    Yield stripped 'input::expected' lines from model output in a single pass,
+    skipping blanks and markdown fences, and stopping once `cap` lines are found.
+    """
+    n = 0
+    for raw in text.splitlines():
+        ln = raw.strip()
+        if not ln or ln.startswith("```") or "::" not in ln:
+            continue
+        yield ln
+        n += 1
+        if n >= cap:
+            return
+
+def _extract_text(data: dict) -> str:
+    """Return the stripped completion text, tolerating missing or empty `choices`."""
+    choices = data.get("choices") or [{}]
+    return (choices[0].get("text") or "").strip()
+
+def _post_with_retry(headers: dict, payload: dict) -> requests.Response:
+    """POST to Groq, retrying 429/5xx responses with exponential backoff + jitter."""
+    for attempt in range(_MAX_ATTEMPTS):
+        response = _SESSION.post(GROQ_COMPLETIONS_URL, headers=headers, json=payload, timeout=_TIMEOUT)
+        if response.status_code not in _RETRY_STATUSES or attempt == _MAX_ATTEMPTS - 1:
+            return response
+        delay = backoff_delay(attempt, retry_after_seconds(response.headers))
+        logger.warning("Groq returned %s; retrying in %.2fs", response.status_code, delay)
+        time.sleep(delay)
+    return response
 
 def generate_test_cases_with_groq(code_text: str, max_cases: int = 8) -> dict:
     """
@@ -16,59 +79,42 @@ def generate_test_cases_with_groq(code_text: str, max_cases: int = 8) -> dict:
     if not api_key:
         return {"status": "error", "tests": [], "reason": "GROQ_API_KEY missing"}
 
-    prompt = f"""
-You are a precise test case generator for C programs.
-
-Analyze the following code and produce up to {max_cases} test cases to verify its correctness.
-
-Each test case should be one line:
-<input_values>::<expected_output>
-
-Use numeric examples. No markdown, no explanations.
-
-C program:
-{code_text}
-"""
+    prompt = (
+        f"Write up to {max_cases} numeric test cases for this C program, one per line as "
+        f"<input_values>::<expected_output>. No markdown, no explanations.\n\n"
+        f"C program:\n{clip_code(code_text)}\n"
+    )
 
     try:
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-            "model": "openai/gpt-oss-120b",
-            "prompt": prompt,
-            "temperature": 0.2,
-            "max_tokens": 400
-        }
-
-        response = requests.post(
-            "https://api.groq.com/openai/v1/completions",
-            headers=headers,
-            json=payload,
-            timeout=40
-        )
-
-        logger.info(f"Groq API status: {response.status_code}")
+        payload = {**_PAYLOAD_BASE, "prompt": prompt}
+        response = _post_with_retry(_headers(api_key), payload)
+
+        logger.info("Groq API status: %s", response.status_code)
         if response.status_code != 200:
-            logger.error(f"Groq error: {response.text[:300]}")
+            logger.error("Groq error: %s", response.text[:300])
             return {"status": "error", "tests": [], "reason": f"Groq error {response.status_code}"}
 
         data = response.json()
-        text = data.get("choices", [{}])[0].get("text", "").strip()
+        text = _extract_text(data)
         if not text:
-            logger.error(f"Groq OSS 20B returned no text. Full response: {json.dumps(data, indent=2)[:300]}")
+            logger.error("Groq OSS 20B returned no text. Full response: %.300s", data)
             return {"status": "error", "tests": [], "reason": "Empty response from Groq"}
 
-        lines = [ln.strip() for ln in text.splitlines() if "::" in ln]
+        lines = list(_iter_tests(text, max_cases))
         if lines:
-            logger.info(f"Groq OSS 120B produced {len(lines)} test cases.")
-            return {"status": "ok", "tests": lines[:max_cases], "reason": "Groq OSS 20B test generation successful"}
+            logger.info("Groq OSS 120B produced %d test cases.", len(lines))
+            return {"status": "ok", "tests": lines, "reason": "Groq OSS 20B test generation successful"}
 
         logger.warning("Groq OSS 120B response had no valid test lines.")
         return {"status": "error", "tests": [], "reason": "No '::' formatted lines found"}
 
     except Exception as e:
-        logger.error(f"Groq OSS 120B request failed: {e}")
+        logger.error("Groq OSS 120B request failed: %s", e)
         return {"status": "error", "tests": [], "reason": str(e)}
+
+async def generate_test_cases_with_groq_async(code_text: str, max_cases: int = 8) -> dict:
+    """
+    Awaitable generate_test_cases_with_groq. The pooled requests session is
+    blocking, so the call runs in a worker thread instead of stalling the event loop.
+    """
+    return await asyncio.to_thread(generate_test_cases_with_groq, code_text, max_cases)
@@ -0,0 +1,144 @@
+# llm_cache.py
+import os
+import json
+import queue
+import atexit
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------- IN-MEMORY LRU + TTL CACHE ----------------
+class TTLCache:
+    """
+    Bounded LRU cache whose entries also expire after `ttl` seconds.
+    Keeps LLM responses around in the long-running Streamlit process
+    without letting memory grow with every graded submission.
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            stored_at, value = item
+            if stored_at + self.ttl < time.monotonic():
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._data)}
+
+
+# ---------------- PERSISTENT SQLITE CACHE ----------------
+class LLMCache:
+    """
+    On-disk response cache (SQLite) that survives restarts, so re-grading the
+    same submission costs no tokens. Values are stored as JSON; entries older
+    than `ttl` seconds are treated as misses. If the database cannot be opened
+    (e.g. read-only filesystem) the cache degrades to a no-op.
+
+    Writes go through a bounded queue to a background thread, so a grading run
+    never waits on a SQLite commit; when the queue is full, `set` blocks until
+    the writer catches up. Call `flush()` to wait for pending writes.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 86400, max_pending: int = 256):
+        self.path = path or os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3")
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending: "queue.Queue[tuple]" = queue.Queue(maxsize=max_pending)
+        try:
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS cache(key TEXT PRIMARY KEY, val TEXT, ts INTEGER)")
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning("LLM disk cache disabled (%s): %s", self.path, e)
+            self._conn = None
+            return
+        threading.Thread(target=self._writer, name="llm-cache-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def get(self, key: str) -> Optional[Any]:
+        if self._conn is None:
+            return None
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT val, ts FROM cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("LLM disk cache read failed: %s", e)
+            row = None
+        if row is None or row[1] + self.ttl < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        if self._conn is None:
+            return
+        self._pending.put((key, json.dumps(value), int(time.time())))
+
+    def flush(self) -> None:
+        """Block until every queued write has been committed."""
+        if self._conn is not None:
+            self._pending.join()
+
+    def _writer(self) -> None:
+        while True:
+            rows = [self._pending.get()]
+            # drain whatever else is queued so a burst costs one commit
+            while True:
+                try:
+                    rows.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._lock:
+                    self._conn.executemany("INSERT OR REPLACE INTO cache(key, val, ts) VALUES (?, ?, ?)", rows)
+                    self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("LLM disk cache write failed: %s", e)
+            finally:
+                for _ in rows:
+                    self._pending.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,43 @@
+# llm_utils.py
+# Helpers shared by the LangChain agents (llm_agents) and the raw Groq client
+# (groq_llm), so both clip prompts and back off the same way.
+import os
+import random
+import logging
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------- PROMPT SIZE LIMITS ----------------
+# Sources longer than this are clipped (head + tail) before going into a prompt,
+# bounding worst-case token cost; override with LLM_MAX_CODE_CHARS.
+MAX_CODE_CHARS = int(os.getenv("LLM_MAX_CODE_CHARS", "4096"))
+
+
+def clip_code(code_text: str, limit: int = MAX_CODE_CHARS) -> str:
+    """Keep the head and tail of oversized sources (includes/main and the return path)."""
+    if len(code_text) <= limit:
+        return code_text
+    logger.warning("C source is %d chars; truncating to %d for the LLM prompt.", len(code_text), limit)
+    half = limit // 2
+    return code_text[:half] + "\n/* ... TRUNCATED ... */\n" + code_text[-half:]
+
+
+# ---------------- RETRY BACKOFF ----------------
+# A server-sent Retry-After is honoured up to this many seconds.
+MAX_RETRY_AFTER = 60.0
+
+
+def retry_after_seconds(headers: Any) -> Optional[float]:
+    """Seconds from a Retry-After header, or None if absent or in the HTTP-date form."""
+    try:
+        return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with jitter, stretched to the server's Retry-After when it asks for longer."""
+    delay = min(30.0, 0.25 * 2 ** attempt) + random.random() * 0.1
+    return max(delay, min(retry_after, MAX_RETRY_AFTER)) if retry_after else delay